@@ -1,11 +1,21 @@
+import argparse
 import subprocess
 import time
-import matplotlib.pyplot as plt
 import os
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-def run_boltz(yaml_path, out_dir, diff_samples=1, aff_samples=None):
+def get_num_gpus():
+    """Number of visible CUDA devices; serial fallback if torch is unsure."""
+    try:
+        import torch
+        return max(1, torch.cuda.device_count())
+    except Exception:
+        return 1
+
+def run_boltz(yaml_path, out_dir, diff_samples=1, aff_samples=None, gpu_id=None):
     # Use 'boltz' directly as we'll run this script inside the mamba env
     cmd = [
         "boltz", "predict", str(yaml_path),
@@ -15,40 +25,61 @@ def run_boltz(yaml_path, out_dir, diff_samples=1, aff_samples=None):
     ]
     if aff_samples is not None:
         cmd.extend(["--diffusion_samples_affinity", str(aff_samples)])
-    
+
+    env = os.environ.copy()
+    if gpu_id is not None:
+        env["CUDA_VISIBLE_DEVICES"] = str(gpu_id)
+
     print(f"Executing: {' '.join(cmd)}")
     start = time.time()
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    # Stream output instead of buffering megabytes of progress-bar logs
+    # into a string; keep only a short tail for error context.
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True)
+    tail = deque(maxlen=50)
+    for line in proc.stdout:
+        tail.append(line)
+    proc.wait()
     end = time.time()
-    
-    if result.returncode != 0:
-        print(f"Error running boltz:\nSTDOUT: {result.stdout}\nSTDERR: {result.stderr}")
+
+    if proc.returncode != 0:
+        print(f"Error running boltz (last {len(tail)} lines):\n{''.join(tail)}")
         sys.exit(1)
-        
+
     return end - start
 
 def main():
+    parser = argparse.ArgumentParser(description="Boltz timing benchmark")
+    parser.add_argument("--plot", action="store_true",
+                        help="Also render the pie chart (requires matplotlib)")
+    args = parser.parse_args()
+
     yaml_path = "/home/ubuntu/boltz_finetune_and_hallucination/infer/affinity_test/configs/variant_1_2_AG.yaml"
     base_out = Path("/home/ubuntu/boltz_finetune_and_hallucination/infer/benchmarks")
     base_out.mkdir(parents=True, exist_ok=True)
 
-    print("Starting benchmarks...")
-    
-    # 1. Structure only, 1 sample
-    print("\n[1/4] Running structure only (1 sample)...")
-    t1 = run_boltz(yaml_path, base_out / "t1", diff_samples=1)
-    
-    # 2. Structure only, 5 samples
-    print("\n[2/4] Running structure only (5 samples)...")
-    t2 = run_boltz(yaml_path, base_out / "t2", diff_samples=5)
-    
-    # 3. Structure (1) + Affinity (5)
-    print("\n[3/4] Running structure (1) + affinity (5 samples)...")
-    t3 = run_boltz(yaml_path, base_out / "t3", diff_samples=1, aff_samples=5)
-    
-    # 4. Structure (1) + Affinity (10)
-    print("\n[4/4] Running structure (1) + affinity (10 samples)...")
-    t4 = run_boltz(yaml_path, base_out / "t4", diff_samples=1, aff_samples=10)
+    n_gpus = get_num_gpus()
+    print(f"Starting benchmarks ({n_gpus} GPU(s) available)...")
+
+    # The four runs are independent, so launch them concurrently with one
+    # GPU pinned per run; wall-clock time becomes max(t_i) instead of sum.
+    # With a single GPU max_workers=1 degrades back to the serial order.
+    configs = [
+        ("structure only (1 sample)", {"diff_samples": 1}),
+        ("structure only (5 samples)", {"diff_samples": 5}),
+        ("structure (1) + affinity (5 samples)", {"diff_samples": 1, "aff_samples": 5}),
+        ("structure (1) + affinity (10 samples)", {"diff_samples": 1, "aff_samples": 10}),
+    ]
+
+    with ThreadPoolExecutor(max_workers=n_gpus) as executor:
+        futures = []
+        for i, (desc, kwargs) in enumerate(configs):
+            print(f"[{i + 1}/4] Queueing {desc}...")
+            futures.append(executor.submit(
+                run_boltz, yaml_path, base_out / f"t{i + 1}",
+                gpu_id=i % n_gpus, **kwargs
+            ))
+        t1, t2, t3, t4 = [f.result() for f in futures]
 
     # Derived timings
     struct_sample_time = (t2 - t1) / 4
@@ -60,17 +91,44 @@ def main():
     print(f"Time per Structure Sample: {struct_sample_time:.2f}s")
     print(f"Time per Affinity Sample: {affinity_sample_time:.2f}s")
 
-    # Create a pie chart for a standard run: 1 structure sample, 5 affinity samples
+    # Breakdown for a standard run: 1 structure sample, 5 affinity samples
     labels = ['Overhead', 'Structure Prediction (1 sample)', 'Affinity Prediction (5 samples)']
     sizes = [fixed_overhead, struct_sample_time, affinity_sample_time * 5]
-    
+
     # Ensure no negative values due to noise
     sizes = [max(0.1, s) for s in sizes]
 
+    # Machine-readable output by default; the chart is opt-in.
+    csv_path = base_out / "timing_breakdown.csv"
+    csv_path.write_text(
+        "overhead,struct_sample,aff_sample\n"
+        f"{fixed_overhead},{struct_sample_time},{affinity_sample_time}\n"
+    )
+    print(f"\nTimings written to: {csv_path}")
+
+    total = sum(sizes)
+    print("Breakdown (1 struct sample, 5 affinity samples):")
+    for label, size in zip(labels, sizes):
+        print(f"  {label}: {size:.2f}s ({100 * size / total:.1f}%)")
+
+    if not args.plot:
+        return
+
+    # Import matplotlib only now, after all predictions have run, and
+    # force the headless Agg backend: no GUI probe, no ~80 MB of RSS
+    # sitting around during the benchmarks themselves.
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib not available; skipping pie chart (text summary above).")
+        return
+
     plt.figure(figsize=(10, 7))
     plt.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=140)
     plt.title('Time Consumption Breakdown (1 Struct Sample, 5 Affinity Samples)')
-    
+
     plot_path = "/home/ubuntu/boltz_finetune_and_hallucination/infer/timing_breakdown.png"
     plt.savefig(plot_path)
     print(f"\nPie plot saved to: {plot_path}")
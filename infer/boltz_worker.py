@@ -0,0 +1,50 @@
+"""Long-lived boltz prediction worker.
+
+Launched once by run_boltz_batch.py inside the boltz env. Imports torch
+and the boltz entrypoint a single time, then serves prediction requests
+as JSON lines on stdin:
+
+    {"yaml_path": "...", "out_dir": "...", "extra_args": ["--flag", ...]}
+
+After each request it prints a single ack line (ACK_DONE, or ACK_FAIL
+followed by a one-line message) on stdout so the driver knows when to
+dispatch the next one. This avoids paying the mamba env activation +
+interpreter + torch import cost per task.
+"""
+import json
+import sys
+import traceback
+
+# Ack lines share stdout with boltz's own logging, so use a sentinel
+# prefix no plausible log line starts with. The driver imports these.
+ACK_DONE = "@@BOLTZ_WORKER DONE"
+ACK_FAIL = "@@BOLTZ_WORKER FAIL"
+
+
+def main():
+    # Imported here, not at module top, so the driver (which runs in a
+    # different env) can import the ack constants without pulling torch.
+    from boltz.main import predict
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            msg = json.loads(line)
+            cli_args = [msg["yaml_path"], "--out_dir", msg["out_dir"]]
+            cli_args.extend(msg.get("extra_args", []))
+            # Invoke the click command in-process; standalone_mode=False
+            # stops click from calling sys.exit() between requests.
+            predict.main(cli_args, standalone_mode=False)
+            print(ACK_DONE, flush=True)
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            # The ack must stay a single line: a multi-line message
+            # would leak its tail into the next request's stream.
+            reason = " ".join(str(e).split())
+            print(f"{ACK_FAIL} {reason}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,128 @@
 import argparse
+import mmap
+import multiprocessing as mp
 from pathlib import Path
 
+import numpy as np
+
 # Standard 20 amino acids
 AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
 
+# Above this estimated variant-matrix size the NumPy path is replaced by
+# the streaming mmap writer, which keeps peak heap at O(L).
+MATRIX_BYTES_LIMIT = 256 * 1024 * 1024
+
+def enumerate_variants(sequence, indices):
+    """Build all single-point variants at the given 0-based indices.
+
+    Vectorized: the wild-type sequence is tiled into a (n_variants, L)
+    uint8 matrix and all mutations are scattered in with one fancy-index
+    assignment, instead of copying a Python list per variant. Returns
+    (matrix, col_idx, wt_aa, mut_aa) where the last three are per-row
+    arrays of mutated column, wild-type byte and mutant byte.
+    """
+    seq = np.frombuffer(sequence.encode("ascii"), dtype=np.uint8)
+    aa = np.frombuffer(AMINO_ACIDS.encode("ascii"), dtype=np.uint8)
+
+    idx = np.asarray(indices, dtype=np.intp)
+    wt = seq[idx]  # (P,)
+
+    # 19 substitutions per position: drop the wild-type residue
+    keep = aa[None, :] != wt[:, None]  # (P, 20)
+    per_pos = keep.sum(axis=1)
+    col_idx = np.repeat(idx, per_pos)
+    wt_aa = np.repeat(wt, per_pos)
+    mut_aa = np.broadcast_to(aa, keep.shape)[keep]
+
+    mat = np.broadcast_to(seq, (len(col_idx), len(seq))).copy()
+    mat[np.arange(len(col_idx)), col_idx] = mut_aa
+    return mat, col_idx, wt_aa, mut_aa
+
+def format_variant_records(header, sequence, indices):
+    """Byte-format the variant FASTA records for the given 0-based indices.
+
+    Module-level so multiprocessing workers can pickle it; mutagenesis is
+    embarrassingly parallel across positions.
+    """
+    mat, col_idx, wt_aa, mut_aa = enumerate_variants(sequence, indices)
+    header_bytes = header.encode("ascii")
+    buf = bytearray()
+    for i in range(len(col_idx)):
+        # Format: OriginalHeader_Pos_WTtoMUT
+        suffix = f"_{chr(wt_aa[i])}{col_idx[i] + 1}{chr(mut_aa[i])}".encode("ascii")
+        buf += b">" + header_bytes + suffix + b"\n" + mat[i].tobytes() + b"\n"
+    return bytes(buf), len(col_idx)
+
 def parse_fasta(fasta_path):
-    """Simple FASTA parser."""
+    """Simple FASTA parser: streams the first record without slurping the file."""
+    header, seq_parts = None, []
     with open(fasta_path, 'r') as f:
-        lines = f.readlines()
-        if not lines:
-            raise ValueError("Empty FASTA file")
-        header = lines[0].strip().lstrip(">")
-        sequence = "".join(line.strip() for line in lines[1:])
-    return header, sequence
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(">"):
+                if header is not None:
+                    break  # only the first record is mutated
+                header = line.lstrip(">")
+            else:
+                seq_parts.append(line)
+    if header is None:
+        raise ValueError("Empty FASTA file")
+    return header, "".join(seq_parts)
+
+def write_variants_mmap(out_file, header, sequence, indices):
+    """Stream all variants straight into a preallocated mmap'd file.
+
+    For huge scans the (n_variants, L) matrix from enumerate_variants is
+    95% duplicated wild-type bytes; here each record is one memcpy of
+    the wild-type line plus a single-byte patch of the mutated residue,
+    so peak heap stays O(L) regardless of variant count. Returns the
+    number of variants written.
+    """
+    header_bytes = header.encode("ascii")
+    seq_bytes = sequence.encode("ascii")
+    aa_bytes = AMINO_ACIDS.encode("ascii")
+    L = len(seq_bytes)
+
+    # Exact output size: the WT record plus every substitution record,
+    # accounting for the variable width of the 1-based position.
+    total = 1 + len(header_bytes) + 3 + 1 + L + 1  # >header_WT\nseq\n
+    count = 0
+    for idx in indices:
+        n_subs = sum(1 for mut in aa_bytes if mut != seq_bytes[idx])
+        record = 1 + len(header_bytes) + 3 + len(str(idx + 1)) + 1 + L + 1
+        total += n_subs * record
+        count += n_subs
+
+    with open(out_file, "w+b") as f:
+        f.truncate(total)
+        with mmap.mmap(f.fileno(), total) as mm:
+            off = 0
+            wt_record = b">" + header_bytes + b"_WT\n" + seq_bytes + b"\n"
+            mm[off:off + len(wt_record)] = wt_record
+            off += len(wt_record)
+            for idx in indices:
+                wt = seq_bytes[idx]
+                for mut in aa_bytes:
+                    if mut == wt:
+                        continue
+                    name = b">%s_%c%d%c\n" % (header_bytes, wt, idx + 1, mut)
+                    mm[off:off + len(name)] = name
+                    off += len(name)
+                    mm[off:off + L] = seq_bytes
+                    mm[off + idx] = mut
+                    off += L
+                    mm[off] = ord("\n")
+                    off += 1
+    return count
 
 def main():
     parser = argparse.ArgumentParser(description="Saturation Mutator for Protein Sequences")
     parser.add_argument("--fasta", required=True, help="Input FASTA file")
     parser.add_argument("--positions", required=True, help="Comma-separated 1-based indices (e.g. '10,25,100')")
     parser.add_argument("--out_dir", required=True, help="Output directory for the generated FASTA")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for variant generation (default: 1, serial)")
     
     args = parser.parse_args()
     
@@ -29,8 +133,6 @@ def main():
         print(f"Error parsing FASTA: {e}")
         return
         
-    seq_list = list(sequence)
-    
     try:
         positions = [int(p.strip()) for p in args.positions.split(",")]
     except ValueError:
@@ -41,33 +143,47 @@ def main():
     out_dir.mkdir(parents=True, exist_ok=True)
     out_file = out_dir / f"{Path(args.fasta).stem}_saturated.fasta"
 
+    valid_indices = []
+    for pos in positions:
+        if pos < 1 or pos > len(sequence):
+            print(f"Warning: Position {pos} is out of range (1-{len(sequence)}). Skipping.")
+            continue
+        valid_indices.append(pos - 1)
+
+    if args.workers == 1 and 19 * len(valid_indices) * len(sequence) > MATRIX_BYTES_LIMIT:
+        # Scan too large to tile in memory: stream into the output file.
+        variants_count = write_variants_mmap(out_file, header, sequence, valid_indices)
+        print(f"Success! Generated {variants_count} variants at {len(valid_indices)} sites.")
+        print(f"File saved to: {out_file}")
+        return
+
+    if args.workers > 1 and len(valid_indices) > 1:
+        # Positions are independent; farm contiguous chunks out to a
+        # Pool so chunk order (and therefore record order) is preserved.
+        n_chunks = min(args.workers, len(valid_indices))
+        chunk_size = -(-len(valid_indices) // n_chunks)
+        chunks = [valid_indices[i:i + chunk_size]
+                  for i in range(0, len(valid_indices), chunk_size)]
+        with mp.Pool(n_chunks) as pool:
+            results = pool.starmap(
+                format_variant_records,
+                [(header, sequence, chunk) for chunk in chunks]
+            )
+    else:
+        results = [format_variant_records(header, sequence, valid_indices)]
+
+    # Assemble the whole FASTA in one bytes buffer and write it with a
+    # single syscall instead of two writes per variant.
+    buf = bytearray()
+    buf += f">{header}_WT\n{sequence}\n".encode("ascii")
     variants_count = 0
-    with open(out_file, 'w') as f:
-        # Optionally include the wild-type first
-        f.write(f">{header}_WT\n{sequence}\n")
-        
-        for pos in positions:
-            if pos < 1 or pos > len(sequence):
-                print(f"Warning: Position {pos} is out of range (1-{len(sequence)}). Skipping.")
-                continue
-            
-            idx = pos - 1
-            wt_aa = seq_list[idx]
-            
-            for mut_aa in AMINO_ACIDS:
-                if mut_aa == wt_aa:
-                    continue
-                
-                # Create mutation
-                mut_seq = seq_list.copy()
-                mut_seq[idx] = mut_aa
-                
-                # Format: OriginalHeader_Pos_WTtoMUT
-                variant_name = f"{header}_{wt_aa}{pos}{mut_aa}"
-                f.write(f">{variant_name}\n{''.join(mut_seq)}\n")
-                variants_count += 1
-
-    print(f"Success! Generated {variants_count} variants at {len(positions)} sites.")
+    for chunk_bytes, chunk_count in results:
+        buf += chunk_bytes
+        variants_count += chunk_count
+
+    out_file.write_bytes(bytes(buf))
+
+    print(f"Success! Generated {variants_count} variants at {len(valid_indices)} sites.")
     print(f"File saved to: {out_file}")
 
 if __name__ == "__main__":
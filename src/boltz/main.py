@@ -1,3 +1,4 @@
+import hashlib
 import multiprocessing
 import os
 import pickle
@@ -600,16 +601,22 @@ def process_input(  # noqa: C901, PLR0912, PLR0915, D103
         # Parse MSA data
         msas = sorted({c.msa_id for c in target.record.chains if c.msa_id != -1})
         msa_id_map = {}
-        for msa_idx, msa_id in enumerate(msas):
+        for msa_id in msas:
             # Check that raw MSA exists
             msa_path = Path(msa_id)
             if not msa_path.exists():
                 msg = f"MSA file {msa_path} not found."
                 raise FileNotFoundError(msg)  # noqa: TRY301
 
-            # Dump processed MSA
-            processed = processed_msa_dir / f"{target_id}_{msa_idx}.npz"
-            msa_id_map[msa_id] = f"{target_id}_{msa_idx}"
+            # Key the processed MSA by its source file rather than by
+            # target, so records sharing an MSA (e.g. variants of one
+            # protein) featurize it once and share the result.
+            msa_key = hashlib.sha256(
+                f"{msa_path.resolve()}:{max_msa_seqs}".encode()
+            ).hexdigest()[:16]
+            msa_name = f"{msa_path.stem}_{msa_key}"
+            processed = processed_msa_dir / f"{msa_name}.npz"
+            msa_id_map[msa_id] = msa_name
             if not processed.exists():
                 # Parse A3M
                 if msa_path.suffix == ".a3m":
@@ -624,7 +631,12 @@ def process_input(  # noqa: C901, PLR0912, PLR0915, D103
                     msg = f"MSA file {msa_path} not supported, only a3m or csv."
                     raise RuntimeError(msg)  # noqa: TRY301
 
-                msa.dump(processed)
+                # Dump atomically so concurrent preprocessing workers
+                # sharing this MSA never read a partial file. np.savez
+                # appends .npz itself, so the temp name must keep it.
+                tmp = processed.with_name(f"{msa_name}.{os.getpid()}.tmp.npz")
+                msa.dump(tmp)
+                tmp.replace(processed)
 
         # Modify records to point to processed MSA
         for c in target.record.chains: